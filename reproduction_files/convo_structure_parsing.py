@@ -2,125 +2,360 @@
 library into a NetworkX network object.
 """
 
+import logging
+import multiprocessing as mp
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, NamedTuple
+
 import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
 from convokit import Conversation, Corpus
 
+logger = logging.getLogger(__name__)
+
 
 def check_conversation_integrity(convo: Conversation) -> bool:
     """Check conversation integrity for a complete reply-to chain
     (from conversation.id root to leaves)
     """
-    if convo.check_integrity():
+    if convo.check_integrity(verbose=False):
         return True
-    print(f"Conversation {convo.id} is not intact.")
+    logger.debug("Conversation %s is not intact.", convo.id)
     return False
 
 
+_format_deleted_speaker_id = "deleted_speaker_{}".format
+
+
+def _deleted_name(deleted_speaker_id: int) -> str:
+    # formatted strings are not interned; share one copy of each recoded ID
+    return sys.intern(_format_deleted_speaker_id(deleted_speaker_id))
+
+
 def change_deleted_speaker_id(speaker_id: str, deleted_speaker_id: int) -> str:
     """Change a speaker ID to a unique string if it is [deleted]. When Reddit
     users delete their account, post, or comment, their username or comment is
-    replaced with [deleted]."""
-    if speaker_id == "[deleted]":
-        return f"deleted_speaker_{deleted_speaker_id}"
-    return speaker_id
+    replaced with [deleted]. Callers pass a new deleted_speaker_id for each
+    deleted utterance."""
+    return _deleted_name(deleted_speaker_id) if speaker_id == "[deleted]" else speaker_id
 
 
 def get_subreddit_speakers(corpus: Corpus) -> tuple[dict, dict]:
-    """Returns 1) speakers who participated in a subreddit by commenting and
-    2) a speaker's list of subreddits.
+    """Returns 1) speakers who participated in a subreddit by commenting (a
+    frozenset per subreddit) and 2) a speaker's subreddits (a sorted tuple).
+
+    Conversations that fail the integrity check are skipped.
 
     Note: speaker names with 'bot' and '[deleted]' should be handled before this
     data alone can be informative.
     """
     # A subreddit's speakers
     subreddit_users = {}
+    # A speaker's subreddits (a set per speaker, so no duplicates)
+    user_subbredits = {}
+    n_not_intact = 0
 
     for conv in corpus.iter_conversations():
+        if not check_conversation_integrity(conv):
+            n_not_intact += 1
+            continue
         # get speakers in conversation
         speakers = conv.get_speaker_ids()
         subreddit = conv.retrieve_meta('subreddit')
-        if subreddit not in subreddit_users:
-            subreddit_users[subreddit] = set()
-        subreddit_users[subreddit].update(speakers)
-
-    # A speaker's subreddits
-    user_subbredits = {}
-    for sub, speakers in subreddit_users.items():
+        subreddit_users.setdefault(subreddit, set()).update(speakers)
         for iden in speakers:
-            user_subbredits.setdefault(iden, []).append(sub)
+            user_subbredits.setdefault(iden, set()).add(subreddit)
+
+    if n_not_intact:
+        logger.warning("Skipped %d conversations that are not intact.", n_not_intact)
 
+    # compact, read-only collections once construction is done
+    subreddit_users = {sub: frozenset(speakers) for sub, speakers in subreddit_users.items()}
+    user_subbredits = {iden: tuple(sorted(subs)) for iden, subs in user_subbredits.items()}
     return (subreddit_users, user_subbredits)
 
 
-def parse_reddit_convo_structure(corpus: Corpus) -> nx.MultiDiGraph:
-    """Parse a structured Corpus dataset into a network."""
+def get_utterance_table(corpus: Corpus) -> pd.DataFrame:
+    """Returns one row per utterance (indexed by utterance ID) holding the
+    attributes that edges in the MultiDiGraph refer to by key.
 
-    convo_graph = nx.MultiDiGraph()
+    Note: speaker IDs here are the raw ConvoKit IDs, so deleted speakers read
+    [deleted]; the recoded ID is the source node of the utterance's edge.
+    Scores are packed as int32 (Reddit scores fit well within that range).
+    """
+    utts = corpus.get_utterances_dataframe()
+    utts = utts[['conversation_id', 'speaker', 'timestamp', 'meta.score', 'text']]
+    return utts.astype({'meta.score': np.int32})
+
+
+class ReplyEdges(NamedTuple):
+    """Reply-to edges between speakers stored as parallel int32 arrays, one
+    edge per reply (utterances that reply to the post itself have none). Edge i
+    is a reply from speaker_ids[src[i]] to speaker_ids[dst[i]] made in
+    utterance utt_ids[utt[i]] of conversation convo_ids[convo[i]]. Look up
+    utterance text, timestamps, and scores with `get_utterance_table`.
+    """
+    speaker_ids: list[str]
+    utt_ids: list[str]
+    convo_ids: list[str]
+    src: np.ndarray
+    dst: np.ndarray
+    utt: np.ndarray
+    convo: np.ndarray
+    # A speaker's sorted subreddits, including deleted speakers under their recoded IDs
+    user_subbredits: dict[str, tuple[str, ...]]
+
+
+# Corpus shared with forked worker processes in iter_conversation_replies
+_worker_corpus = None
+
+
+def get_conversation_replies(
+    convo: Conversation
+) -> tuple[str, str, list[str], dict[str, tuple[str, str]]] | None:
+    """Returns the replies in one conversation, or None if it is not intact.
+
+    The result is (conversation ID, subreddit, speaker IDs, utterance info),
+    where utterance info maps every utterance except the post itself to its
+    (speaker ID, ID of the utterance it replies to). Speaker IDs are left as
+    [deleted] here because deleted speakers are numbered across the whole
+    corpus.
+    """
+    if not check_conversation_integrity(convo):
+        return None
+
+    # resolve each utterance's speaker once; it is both the replying speaker
+    # and the speaker replied to
+    utt_info = {}
+    for utt in convo.iter_utterances():
+        if utt.reply_to is not None:
+            utt_info[utt.id] = (utt.speaker.id, utt.reply_to)
+
+    sub = convo.retrieve_meta('subreddit')
+    return (convo.id, sub, convo.get_speaker_ids(), utt_info)
+
+
+def _get_worker_conversation_replies(convo_id: str):
+    return get_conversation_replies(_worker_corpus.get_conversation(convo_id))
+
+
+def iter_conversation_replies(corpus: Corpus, n_jobs: int = 1) -> Iterator:
+    """Yield get_conversation_replies() for each conversation in corpus order.
+
+    With n_jobs > 1 on Linux, conversations are parsed in that many worker
+    processes. Workers are forked so they share the corpus instead of
+    receiving a pickled copy with every conversation. Forking is only safe by
+    default on Linux (macOS and Windows use spawn), so on other platforms
+    parsing stays in this process.
+    """
+    global _worker_corpus
+    if n_jobs <= 1 or not sys.platform.startswith('linux'):
+        yield from map(get_conversation_replies, corpus.iter_conversations())
+        return
+
+    _worker_corpus = corpus
+    try:
+        with ProcessPoolExecutor(n_jobs, mp_context=mp.get_context('fork')) as pool:
+            yield from pool.map(
+                _get_worker_conversation_replies,
+                corpus.get_conversation_ids(),
+                chunksize=64
+            )
+    finally:
+        _worker_corpus = None
+
+
+def index_reply_edges(corpus: Corpus, n_jobs: int = 1) -> ReplyEdges:
+    """Walk a structured Corpus dataset once and record its reply-to edges by
+    integer speaker and utterance index.
+
+    Both network types are built from these arrays, so speaker and utterance
+    ID strings are only hashed once here rather than on every graph insert.
+    Conversations are parsed in n_jobs processes (see
+    iter_conversation_replies).
+    """
     deleted_speaker_id = 0
-    # Node attribute later that needs updating as we fix deleted speakers
-    subreddit_users, user_subbredits = get_subreddit_speakers(corpus)
+    speaker_idx = {}
+    utt_idx = {}
+    convo_ids = []
+    # each utterance replies at most once, so the number of utterances bounds
+    # the number of edges; fill preallocated arrays up to a write cursor
+    n_utts = len(corpus.get_utterance_ids())
+    src, dst, utt_col, convo_col = (np.empty(n_utts, dtype=np.int32) for _ in range(4))
+    cursor = 0
+    user_subbredits = {}
+    n_not_intact = 0
+    # bind methods used on every utterance or edge to locals
+    speaker_index, utt_index = speaker_idx.setdefault, utt_idx.setdefault
 
     # starting from utterances and replies, construct edges,
     # which will initialize sepakers as nodes
-    for convo in corpus.iter_conversations():
-        sub = convo.retrieve_meta('subreddit')
-
-        if not check_conversation_integrity(convo):
+    for result in iter_conversation_replies(corpus, n_jobs):
+        if result is None:
+            n_not_intact += 1
             continue
-
-        convo_paths = []
-        for path in convo.get_root_to_leaf_paths():
-            convo_paths.append([utt.id for utt in path])
-
-        for path in convo_paths:
-            # magic number 2 skips the first utterance because it's the post itself
-            for utt_id in path[2:]:
-                from_speaker = change_deleted_speaker_id(
-                    convo.get_utterance(utt_id).speaker.id,
-                    deleted_speaker_id
-                )
-                to_speaker = change_deleted_speaker_id(
-                    convo.get_utterance(path[path.index(utt_id)-1]).speaker.id,
-                    deleted_speaker_id
-                )
-                # Add edges and edge attributes
-                convo_graph.add_edge(
-                    from_speaker,
-                    to_speaker,
-                    key=utt_id,
-                    convo_id=convo.id,
-                    utt_id=utt_id,
-                    utt_text=convo.get_utterance(utt_id).text,
-                    utt_speaker=from_speaker,
-                    utt_timestamp=convo.get_utterance(utt_id).timestamp,
-                    utt_score=convo.get_utterance(utt_id).meta['score']
-                )
-                # Add new user ID to user_subreddits
-                if from_speaker not in user_subbredits:
-                    user_subbredits[from_speaker] = [sub]
+        convo_id, sub, speakers, utt_info = result
+
+        convo_i = len(convo_ids)
+        convo_ids.append(convo_id)
+        for speaker in speakers:
+            user_subbredits.setdefault(speaker, set()).add(sub)
+
+        # resolve each utterance to speaker and utterance indices once;
+        # every [deleted] utterance gets its own speaker ID
+        utt_indices = {}
+        for utt_id, (speaker, _) in utt_info.items():
+            if speaker == "[deleted]":
+                speaker = change_deleted_speaker_id(speaker, deleted_speaker_id)
+                deleted_speaker_id += 1
                 # add subreddit for each deleted user
-                if sub not in user_subbredits[from_speaker]:
-                    user_subbredits[from_speaker].append(sub)
-            # deleted_speaker_id is uniquely set per branch (top-level comment) in conversation
-            # (unindenting once makes it per entire conversation)
-            deleted_speaker_id += 1
+                user_subbredits.setdefault(speaker, set()).add(sub)
+            utt_indices[utt_id] = (
+                speaker_index(speaker, len(speaker_idx)),
+                utt_index(utt_id, len(utt_idx))
+            )
+
+        convo_src, convo_dst, convo_utt = [], [], []
+        src_append, dst_append = convo_src.append, convo_dst.append
+        utt_append = convo_utt.append
+        # pair each reply with the utterance it replies to; top-level
+        # comments reply to the post itself and make no edge
+        for utt_id, (_, reply_to) in utt_info.items():
+            parent = utt_indices.get(reply_to)
+            if parent is None:
+                continue
+            from_i, utt_i = utt_indices[utt_id]
+            src_append(from_i)
+            dst_append(parent[0])
+            utt_append(utt_i)
+
+        n_edges = len(convo_src)
+        src[cursor:cursor + n_edges] = convo_src
+        dst[cursor:cursor + n_edges] = convo_dst
+        utt_col[cursor:cursor + n_edges] = convo_utt
+        convo_col[cursor:cursor + n_edges] = convo_i
+        cursor += n_edges
+
+    if n_not_intact:
+        logger.warning("Skipped %d conversations that are not intact.", n_not_intact)
+
+    return ReplyEdges(
+        speaker_ids=list(speaker_idx),
+        utt_ids=list(utt_idx),
+        convo_ids=convo_ids,
+        # copy so the oversized buffers are released
+        src=src[:cursor].copy(),
+        dst=dst[:cursor].copy(),
+        utt=utt_col[:cursor].copy(),
+        convo=convo_col[:cursor].copy(),
+        user_subbredits={iden: tuple(sorted(subs)) for iden, subs in user_subbredits.items()}
+    )
+
+
+def get_reply_matrix(edges: ReplyEdges) -> sparse.csr_array:
+    """Returns a sparse speaker-by-speaker matrix where entry (i, j) is the
+    number of replies from edges.speaker_ids[i] to edges.speaker_ids[j].
+
+    Useful when only connectivity and reply counts are needed; see
+    reply_matrix_to_networkx for a DiGraph. Counts are stored as int32.
+    """
+    # duplicate (src, dst) entries are summed into reply counts
+    n_speakers = len(edges.speaker_ids)
+    return sparse.csr_array(
+        (np.ones(len(edges.src), dtype=np.int32), (edges.src, edges.dst)),
+        shape=(n_speakers, n_speakers)
+    )
+
+
+def reply_matrix_to_networkx(
+    matrix: sparse.csr_array,
+    speaker_ids: list[str]
+) -> nx.DiGraph:
+    """Convert a reply matrix into a DiGraph with reply counts as edge weights
+    and speaker IDs as nodes."""
+    coo = matrix.tocoo()
+    convo_graph = nx.DiGraph()
+    convo_graph.add_weighted_edges_from(zip(
+        [speaker_ids[i] for i in coo.row.tolist()],
+        [speaker_ids[j] for j in coo.col.tolist()],
+        coo.data.tolist()
+    ))
+    return convo_graph
+
 
+def add_node_attributes(
+    convo_graph: nx.DiGraph,
+    corpus: Corpus,
+    user_subbredits: dict[str, tuple[str, ...]]
+) -> None:
+    """Add subreddits and comment counts to every node in the network."""
     # Add node attributes (this will not add isolated nodes--submitters who
     # have 0 comments reflected in this corpus)
-    # Cannot look up deleted speakers' s.meta['num_comments'],
-    # which is their number of out-edges bc deleted speaker is set per convo
-    all_speakers = {speaker for speaker in corpus.get_speaker_ids()}
-    for node in convo_graph.nodes:
-        try:
-            convo_graph.nodes[node]['subreddits'] = user_subbredits[node]
-        except:
-            convo_graph.nodes[node]['subreddits'] = []
-
-        if node in all_speakers:
-            convo_graph.nodes[node]['num_comments'] = corpus.get_speaker(node).meta['num_comments']
-        else:  # deleted speaker and their num_comments is the number of out-edges
-            convo_graph.nodes[node]['num_comments'] = convo_graph.out_degree(node)
+    # Cannot look up deleted speakers' s.meta['num_comments'], which is 1
+    # bc deleted speaker is set per utterance
+    nx.set_node_attributes(
+        convo_graph,
+        {node: list(user_subbredits.get(node, ())) for node in convo_graph.nodes},
+        'subreddits'
+    )
+
+    # each recoded deleted speaker wrote exactly one comment; every other
+    # speaker's num_comments comes from the corpus, filtered to the nodes in
+    # one join
+    speakers_df = pd.DataFrame(
+        [(s.id, s.meta['num_comments']) for s in corpus.iter_speakers()],
+        columns=['id', 'num_comments']
+    ).set_index('id')
+    speakers_df = speakers_df.loc[speakers_df.index.intersection(list(convo_graph.nodes))]
+    num_comments = dict.fromkeys(convo_graph.nodes, 1)
+    num_comments.update(speakers_df['num_comments'].to_dict())
+    nx.set_node_attributes(convo_graph, num_comments, 'num_comments')
+
+
+def parse_reddit_convo_structure(
+    corpus: Corpus,
+    utterance_attrs: bool = False,
+    n_jobs: int = 1
+) -> nx.MultiDiGraph:
+    """Parse a structured Corpus dataset into a network.
+
+    Edges are keyed by utterance ID; look up an utterance's text, timestamp,
+    and score with `get_utterance_table` rather than copying them onto every
+    edge. Set `utterance_attrs` to also store them as edge attributes (e.g. for
+    writing a self-contained .gml file). Set `n_jobs` to parse conversations
+    in parallel worker processes.
+    """
+    edges = index_reply_edges(corpus, n_jobs)
+    speaker_ids, utt_ids = edges.speaker_ids, edges.utt_ids
+
+    # Collect edges and edge attributes, then insert them in one batch
+    edge_list = []
+    for from_i, to_i, utt_i, convo_i in zip(
+        edges.src.tolist(), edges.dst.tolist(), edges.utt.tolist(), edges.convo.tolist()
+    ):
+        from_speaker = speaker_ids[from_i]
+        utt_id = utt_ids[utt_i]
+        if utterance_attrs:
+            utt = corpus.get_utterance(utt_id)
+            edge_attrs = {
+                'convo_id': edges.convo_ids[convo_i],
+                'utt_id': utt_id,
+                'utt_text': utt.text,
+                'utt_speaker': from_speaker,
+                'utt_timestamp': utt.timestamp,
+                'utt_score': utt.meta['score'],
+            }
+        else:
+            edge_attrs = {}
+        edge_list.append((from_speaker, speaker_ids[to_i], utt_id, edge_attrs))
 
+    convo_graph = nx.MultiDiGraph()
+    convo_graph.add_edges_from(edge_list)
+
+    add_node_attributes(convo_graph, corpus, edges.user_subbredits)
     return convo_graph
 
 
@@ -145,76 +380,19 @@ def two_convo_sample(corpus: Corpus) -> tuple[Corpus, nx.MultiDiGraph]:
     return (new_corpus, G)
 
 
-def parse_reddit_convo_structure_digraph(corpus: Corpus) -> nx.DiGraph:
+def parse_reddit_convo_structure_digraph(corpus: Corpus, n_jobs: int = 1) -> nx.DiGraph:
     """Parse a structured Corpus dataset into a weighted network.
 
     Note: edges represent accumulated weight, so we lose the ability to keep all
     utterance information.
     TODO: Some thought has to go into representing this info via proxy edge and
     node attributes.
-    """
-    convo_graph = nx.DiGraph()
-    deleted_speaker_id = 0
-    # Node attribute later that needs updating as we fix deleted speakers
-    subreddit_users, user_subbredits = get_subreddit_speakers(corpus)
-
-    # starting from utterances and replies, construct edges,
-    # which will initialize sepakers as nodes
-    for convo in corpus.iter_conversations():
-        sub = convo.retrieve_meta('subreddit')
-        from_speaker_weights = {x: 0 for x in convo.get_speaker_ids()}
-
-        if not check_conversation_integrity(convo):
-            continue
-
-        convo_paths = []
-        for path in convo.get_root_to_leaf_paths():
-            convo_paths.append([utt.id for utt in path])
-
-        for path in convo_paths:
-            # magic number 2 skips the first utterance because it's the post itself
-            for utt_id in path[2:]:
-                from_speaker = change_deleted_speaker_id(
-                    convo.get_utterance(utt_id).speaker.id,
-                    deleted_speaker_id
-                )
-                to_speaker = change_deleted_speaker_id(
-                    convo.get_utterance(path[path.index(utt_id)-1]).speaker.id,
-                    deleted_speaker_id
-                )
-                # Add new user ID to user_subreddits and edge weight tracking
-                if from_speaker not in user_subbredits:
-                    user_subbredits[from_speaker] = [sub]
-                    from_speaker_weights[from_speaker] = 0
-                # add subreddit for each deleted user
-                if sub not in user_subbredits[from_speaker]:
-                    user_subbredits[from_speaker].append(sub)
-                from_speaker_weights[from_speaker] += 1
-
-                # Add edges and edge attributes
-                convo_graph.add_edge(
-                    from_speaker,
-                    to_speaker,
-                    weight=from_speaker_weights[from_speaker]
-                )
-            # deleted_speaker_id is uniquely set per branch (top-level comment) in conversation
-            # (unindenting once makes it per entire conversation)
-            deleted_speaker_id += 1
 
-    # Add node attributes (this will not add isolated nodes--submitters who
-    # have 0 comments reflected in this corpus)
-    # Cannot look up deleted speakers' s.meta['num_comments'],
-    # which is their number of out-edges bc deleted speaker is set per convo
-    all_speakers = {speaker for speaker in corpus.get_speaker_ids()}
-    for node in convo_graph.nodes:
-        try:
-            convo_graph.nodes[node]['subreddits'] = user_subbredits[node]
-        except:
-            convo_graph.nodes[node]['subreddits'] = []
-
-        if node in all_speakers:
-            convo_graph.nodes[node]['num_comments'] = corpus.get_speaker(node).meta['num_comments']
-        else:  # deleted speaker and their num_comments is the number of out-edges
-            convo_graph.nodes[node]['num_comments'] = convo_graph.out_degree(node)
+    Set `n_jobs` to parse conversations in parallel worker processes.
+    """
+    edges = index_reply_edges(corpus, n_jobs)
+    # An edge's weight is the number of replies from one speaker to another
+    convo_graph = reply_matrix_to_networkx(get_reply_matrix(edges), edges.speaker_ids)
 
+    add_node_attributes(convo_graph, corpus, edges.user_subbredits)
     return convo_graph